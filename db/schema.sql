@@ -10,6 +10,7 @@ CREATE TABLE IF NOT EXISTS pm25 (
     monitordate DATE NOT NULL,               -- 監測日期
     concentration REAL,                      -- PM2.5濃度值
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- 資料建立時間
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- 資料最後異動時間（upsert 維護，供增量匯出）
     
     -- 唯一性 同一測站同一日期只能有一筆資料
     UNIQUE(siteid, monitordate),
@@ -21,6 +22,7 @@ CREATE TABLE IF NOT EXISTS pm25 (
 -- 索引
 CREATE INDEX IF NOT EXISTS idx_pm25_date ON pm25(monitordate);
 CREATE INDEX IF NOT EXISTS idx_pm25_county_date ON pm25(county, monitordate);
+CREATE INDEX IF NOT EXISTS idx_pm25_updated_at ON pm25(updated_at);
 
 -- 檢視
 DROP VIEW IF EXISTS latest_pm25;
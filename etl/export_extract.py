@@ -0,0 +1,186 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import datetime
+import pandas as pd
+from etl.log_utils import setup_logging
+from etl.load_to_sqlite import connect_sqlite
+from etl.process_utils import pid_alive
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = "data/export"
+ARCHIVE_DIR = "archive"
+# Tableau 以萬用字元聯集 pm25_*.csv 讀取快照與所有 delta 檔
+SNAPSHOT_FILE = "pm25_snapshot.csv"
+DELTA_PATTERN = "pm25_delta_*.csv"
+STATE_FILE = "export_state.json"
+LOCK_FILE = "export.lock"
+# 等待其他程序的匯入交易結束（完整歷史載入可能需數分鐘）
+EXPORT_BUSY_TIMEOUT_MS = 15 * 60 * 1000
+
+EXPORT_COLUMNS = [
+    "siteid", "sitename", "county", "itemid", "itemname", "itemengname",
+    "itemunit", "monitordate", "concentration", "created_at", "updated_at",
+]
+
+
+def _load_state(state_path):
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(state, state_path):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def _query_rows(conn, cutoff, watermark=None):
+    # 以 [watermark, cutoff) 半開區間擷取，cutoff 當秒寫入的列留待下次匯出
+    select = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM pm25"
+    if watermark is None:
+        sql = f"{select} WHERE updated_at < ? ORDER BY monitordate, siteid"
+        return pd.read_sql_query(sql, conn, params=(cutoff,))
+    sql = f"{select} WHERE updated_at >= ? AND updated_at < ? ORDER BY updated_at, siteid"
+    return pd.read_sql_query(sql, conn, params=(watermark, cutoff))
+
+
+def _acquire_lock(lock_path):
+    """以 O_EXCL 建立鎖檔，避免常駐服務與手動匯出同時改寫 delta 與狀態檔；殘留的鎖（pid 已結束）會被清除"""
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(lock_path, "r", encoding="utf-8") as f:
+                    holder = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                holder = 0
+            if pid_alive(holder):
+                logger.error(f"另一個匯出正在執行 pid={holder}（鎖檔 {lock_path}）")
+                raise RuntimeError(f"Export already running pid={holder}")
+            logger.warning(f"移除殘留的匯出鎖檔 {lock_path}（pid={holder} 已結束）")
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(str(os.getpid()))
+        return
+    raise RuntimeError(f"Unable to acquire export lock {lock_path}")
+
+
+def _release_lock(lock_path):
+    try:
+        os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+
+
+def _delta_filename(cutoff):
+    # cutoff 為 SQLite CURRENT_TIMESTAMP（UTC），檔名依時間排序
+    return f"pm25_delta_{cutoff.replace('-', '').replace(':', '').replace(' ', 'T')}Z.csv"
+
+
+def _archive_deltas(export_dir):
+    """壓實後將已併入快照的 delta 檔以 gzip 移至 archive/，避免 Tableau 聯集時重複計算"""
+    delta_files = sorted(glob.glob(os.path.join(export_dir, DELTA_PATTERN)))
+    if not delta_files:
+        return 0
+    archive_dir = os.path.join(export_dir, ARCHIVE_DIR)
+    os.makedirs(archive_dir, exist_ok=True)
+    for path in delta_files:
+        archive_path = os.path.join(archive_dir, os.path.basename(path) + ".gz")
+        with open(path, "rb") as src, gzip.open(archive_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+    return len(delta_files)
+
+
+def export_pm25_extract(db_path='db/pm25.sqlite', export_dir=EXPORT_DIR, compact_every=30, full=False, conn=None):
+    """增量匯出 pm25 給 Tableau：只寫出上次匯出後新增或異動的列，每 compact_every 次壓實為完整快照"""
+    os.makedirs(export_dir, exist_ok=True)
+    snapshot_path = os.path.join(export_dir, SNAPSHOT_FILE)
+    state_path = os.path.join(export_dir, STATE_FILE)
+    lock_path = os.path.join(export_dir, LOCK_FILE)
+
+    _acquire_lock(lock_path)
+    own_conn = conn is None
+    try:
+        if own_conn:
+            conn = connect_sqlite(db_path)
+            conn.execute(f"PRAGMA busy_timeout = {EXPORT_BUSY_TIMEOUT_MS}")
+        # BEGIN IMMEDIATE 會等進行中的匯入提交後才取得寫入鎖：cutoff 之前的列皆已提交，
+        # 匯出期間的新寫入則排在鎖釋放之後，updated_at 必定不早於 cutoff，watermark 不會越過未提交的列
+        conn.execute("BEGIN IMMEDIATE")
+        state = _load_state(state_path)
+        # 與 updated_at 同樣取 SQLite 的 CURRENT_TIMESTAMP（UTC），確保比較基準一致
+        cutoff = conn.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+        # 狀態檔時間一律記錄 UTC，與 watermark 同一基準
+        now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+        compact = (
+            full
+            or state is None
+            or not os.path.exists(snapshot_path)
+            or state.get("delta_exports", 0) >= compact_every
+        )
+
+        if compact:
+            # 快照每個 (siteid, monitordate) 只有一列；先寫快照再封存 delta，中途失敗也不會遺漏資料
+            df = _query_rows(conn, cutoff)
+            tmp_path = snapshot_path + ".tmp"
+            df.to_csv(tmp_path, index=False, encoding="utf-8-sig")
+            os.replace(tmp_path, snapshot_path)
+            archived = _archive_deltas(export_dir)
+            state = {
+                "watermark_utc": cutoff,
+                "delta_exports": 0,
+                "snapshot_rows": len(df),
+                "delta_rows": 0,
+                "last_compaction_at_utc": now,
+                "last_export_at_utc": now,
+            }
+            _save_state(state, state_path)
+            logger.info(f"已壓實完整快照 {len(df)} 筆至 {snapshot_path}，封存 {archived} 個 delta 檔（watermark={cutoff}）")
+            return snapshot_path
+
+        df = _query_rows(conn, cutoff, watermark=state["watermark_utc"])
+        delta_path = None
+        if not df.empty:
+            delta_path = os.path.join(export_dir, _delta_filename(cutoff))
+            tmp_path = delta_path + ".tmp"
+            df.to_csv(tmp_path, index=False, encoding="utf-8-sig")
+            os.replace(tmp_path, delta_path)
+            state["delta_exports"] = state.get("delta_exports", 0) + 1
+            state["delta_rows"] = state.get("delta_rows", 0) + len(df)
+
+        state["watermark_utc"] = cutoff
+        state["last_export_at_utc"] = now
+        _save_state(state, state_path)
+        logger.info(f"增量匯出 {len(df)} 筆至 {delta_path or '（無異動，未產生檔案）'}（watermark={cutoff}）")
+        return delta_path
+    except Exception:
+        logger.exception("匯出 Tableau extract 時發生錯誤")
+        raise
+    finally:
+        if conn is not None and conn.in_transaction:
+            # 只有讀取，結束交易以釋放寫入鎖
+            conn.rollback()
+        if own_conn and conn is not None:
+            conn.close()
+        _release_lock(lock_path)
+
+
+if __name__ == "__main__":
+    export_pm25_extract(full=len(sys.argv) > 1 and sys.argv[1] == "full")
@@ -87,6 +87,50 @@ def fetch_pm25_daily_data():
         logger.error("所有策略都無法取得資料")
         return None
 
+def _normalize_date(value):
+    # 與 transform 一致：去除空白並只保留前 10 碼
+    return str(value or "").strip().replace("/", "-")[:10]
+
+def fetch_latest_monitordate():
+    """輕量查詢 API 目前最新的 monitordate（只取 1 筆），供常駐模式輪詢使用"""
+    if not API_KEY:
+        logger.error("Missing environment variable PM25_API_KEY")
+        raise RuntimeError("Missing environment variable PM25_API_KEY")
+
+    url = f"{DATA_URL}?language=zh&api_key={API_KEY}&limit=1&sort=monitordate%20desc"
+    res = _session.get_with_timeout(url)
+    if res.status_code != 200:
+        logger.error(f"API 錯誤 {res.status_code}: {res.text[:200]}")
+    res.raise_for_status()
+
+    data = res.json().get("records", [])
+    if not data:
+        return None
+    return _normalize_date(data[0].get("monitordate")) or None
+
+def fetch_monitordate_count(monitordate):
+    """查詢 API 上指定 monitordate 已發布的測站數，供常駐模式判斷該日資料是否已完整入庫"""
+    if not API_KEY:
+        logger.error("Missing environment variable PM25_API_KEY")
+        raise RuntimeError("Missing environment variable PM25_API_KEY")
+
+    url = f"{DATA_URL}?language=zh&api_key={API_KEY}&filters=monitordate,EQ,{monitordate}&limit=5000"
+    res = _session.get_with_timeout(url)
+    if res.status_code != 200:
+        logger.error(f"API 錯誤 {res.status_code}: {res.text[:200]}")
+    res.raise_for_status()
+
+    # 本地再過濾一次日期，並以測站去重（對應資料庫的 UNIQUE(siteid, monitordate)）
+    records = res.json().get("records", [])
+    sites = {
+        r.get("siteid") or r.get("sitename")
+        for r in records
+        if _normalize_date(r.get("monitordate")) == monitordate
+    }
+    sites.discard(None)
+    sites.discard("")
+    return len(sites)
+
 if __name__ == "__main__":
     result = fetch_pm25_daily_data()
     print(f"抓取結果: {result}")
\ No newline at end of file
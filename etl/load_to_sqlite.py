@@ -22,7 +22,22 @@ def _vacuum_analyze(conn: sqlite3.Connection):
     cur.execute("VACUUM;")
     cur.close()
 
-def load_pm25_to_sqlite(csv_file, db_path='db/pm25.sqlite'):
+def _migrate_schema(conn: sqlite3.Connection):
+    """舊資料庫補上 updated_at 欄位（ALTER TABLE 不接受 CURRENT_TIMESTAMP 預設值，改以 created_at 回填）"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(pm25)")}
+    if not columns:
+        return
+    if "updated_at" not in columns:
+        conn.execute("ALTER TABLE pm25 ADD COLUMN updated_at TIMESTAMP")
+        logger.info("已為 pm25 新增 updated_at 欄位")
+    # 遷移後的欄位沒有預設值，先前版本寫入的新列可能留下 NULL，一併回填
+    cur = conn.execute("UPDATE pm25 SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL")
+    if cur.rowcount:
+        logger.info(f"已以 created_at 回填 updated_at：{cur.rowcount} 筆")
+    conn.commit()
+
+def connect_sqlite(db_path='db/pm25.sqlite', schema_path='db/schema.sql'):
+    """開啟 SQLite 連線，套用 PRAGMA 與 schema.sql（常駐模式可重複使用此連線）"""
     db_path = Path(db_path)
     db_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -34,9 +49,11 @@ def load_pm25_to_sqlite(csv_file, db_path='db/pm25.sqlite'):
         logger.exception("無法連線到 SQLite 資料庫")
         raise
 
-    schema_path = Path("db/schema.sql")
+    schema_path = Path(schema_path)
     if schema_path.exists():
         try:
+            # 須在 schema.sql 之前執行，否則 updated_at 索引會建立失敗
+            _migrate_schema(conn)
             with open(schema_path, "r", encoding="utf-8") as f:
                 schema_sql = f.read()
             cursor.executescript(schema_sql)
@@ -48,11 +65,58 @@ def load_pm25_to_sqlite(csv_file, db_path='db/pm25.sqlite'):
     else:
         logger.warning("找不到 schema.sql，略過結構初始化")
 
+    cursor.close()
+    return conn
+
+def get_latest_monitordate(conn: sqlite3.Connection):
+    """回傳資料庫中最新的 monitordate（YYYY-MM-DD），無資料時回傳 None"""
+    try:
+        row = conn.execute("SELECT MAX(monitordate) FROM pm25").fetchone()
+    except sqlite3.OperationalError:
+        # 資料表尚未建立
+        return None
+    return str(row[0])[:10] if row and row[0] else None
+
+def count_monitordate(conn: sqlite3.Connection, monitordate):
+    """回傳資料庫中指定 monitordate 的筆數"""
+    try:
+        row = conn.execute("SELECT COUNT(*) FROM pm25 WHERE monitordate = ?", (monitordate,)).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0]
+
+def get_first_loaded_at(conn: sqlite3.Connection, monitordate):
+    """回傳指定 monitordate 最早入庫的時間（created_at，UTC），用來估計 API 的發布時間"""
+    try:
+        row = conn.execute("SELECT MIN(created_at) FROM pm25 WHERE monitordate = ?", (monitordate,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row and row[0] else None
+
+def count_previous_monitordate(conn: sqlite3.Connection, monitordate):
+    """回傳指定 monitordate 之前最近一日的筆數，作為判斷當日資料是否到齊的參考"""
+    try:
+        row = conn.execute(
+            "SELECT COUNT(*) FROM pm25 WHERE monitordate = (SELECT MAX(monitordate) FROM pm25 WHERE monitordate < ?)",
+            (monitordate,),
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0]
+
+def load_pm25_to_sqlite(csv_file, db_path='db/pm25.sqlite', conn=None):
+    # 傳入 conn 時沿用呼叫端的連線（常駐模式），結束後不關閉
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_sqlite(db_path)
+    cursor = conn.cursor()
+
     try:
         df = pd.read_csv(csv_file)
     except Exception:
         logger.exception(f"讀取清理後 CSV 檔案失敗：{csv_file}")
-        conn.close()
+        if own_conn:
+            conn.close()
         raise
 
     try:
@@ -81,8 +145,8 @@ def load_pm25_to_sqlite(csv_file, db_path='db/pm25.sqlite'):
         ]
 
         cursor.executemany("""
-        INSERT INTO pm25 (siteid, sitename, county, itemid, itemname, itemengname, itemunit, monitordate, concentration)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO pm25 (siteid, sitename, county, itemid, itemname, itemengname, itemunit, monitordate, concentration, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
         ON CONFLICT(siteid, monitordate) DO UPDATE SET
           sitename=excluded.sitename,
           county=excluded.county,
@@ -90,11 +154,20 @@ def load_pm25_to_sqlite(csv_file, db_path='db/pm25.sqlite'):
           itemname=excluded.itemname,
           itemengname=excluded.itemengname,
           itemunit=excluded.itemunit,
-          concentration=excluded.concentration
+          concentration=excluded.concentration,
+          updated_at=CURRENT_TIMESTAMP
+        WHERE pm25.sitename IS NOT excluded.sitename
+           OR pm25.county IS NOT excluded.county
+           OR pm25.itemid IS NOT excluded.itemid
+           OR pm25.itemname IS NOT excluded.itemname
+           OR pm25.itemengname IS NOT excluded.itemengname
+           OR pm25.itemunit IS NOT excluded.itemunit
+           OR pm25.concentration IS NOT excluded.concentration
         """, rows)
 
+        # 內容未變的列不會被更新，updated_at 維持不變（增量匯出依此判斷）
         inserted = cursor.rowcount if cursor.rowcount is not None else len(rows)
-        logger.info(f"Upsert 完成，受影響列數（估計）：{inserted}")
+        logger.info(f"Upsert 完成，新增或異動列數：{inserted}")
     except Exception:
         logger.exception("匯入資料到 SQLite 時發生錯誤")
         raise
@@ -105,7 +178,9 @@ def load_pm25_to_sqlite(csv_file, db_path='db/pm25.sqlite'):
             logger.info("已執行 ANALYZE 與 VACUUM")
         except Exception:
             logger.exception("ANALYZE/VACUUM 發生錯誤（可忽略）")
-        conn.close()
+        cursor.close()
+        if own_conn:
+            conn.close()
 
 if __name__ == '__main__':
     cleaned_csv = 'data/cleaned/pm25_cleaned.csv'
@@ -0,0 +1,32 @@
+import os
+
+
+def pid_alive(pid):
+    """判斷指定 pid 的程序是否仍在執行"""
+    if not pid:
+        return False
+    if os.name == "nt":
+        # Windows 上 os.kill 會直接終止程序，改用 Win32 API 查詢
+        import ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, int(pid))
+        if not handle:
+            return False
+        try:
+            code = ctypes.c_ulong()
+            ok = kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return bool(ok) and code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # 程序存在但屬於其他使用者
+        return True
+    except OSError:
+        return False
+    return True
@@ -15,7 +15,8 @@ setup_logging(log_dir="logs", reset=True)
 set_run_id(run_id)
 logger = logging.getLogger(__name__)
 
-def run_etl_pipeline(mode="all"):
+def run_etl_pipeline(mode="all", conn=None, run_id=run_id):
+    # conn / run_id 由常駐模式（etl.service）傳入；成功回傳 True，失敗回傳 False
     started = datetime.datetime.now()
     logger.info(f"ETL 開始 run_id={run_id} mode={mode}")
 
@@ -27,7 +28,7 @@ def run_etl_pipeline(mode="all"):
                 logger.info(f"資料抓取完成：{result}")
             else:
                 logger.error("資料抓取失敗，無資料產生")
-                return
+                return False
 
         if mode in ("transform", "all"):
             cleaned_csv = transform_pm25_data()
@@ -35,11 +36,11 @@ def run_etl_pipeline(mode="all"):
                 logger.info(f"資料清洗完成：{cleaned_csv}")
             else:
                 logger.error("資料清洗失敗")
-                return
+                return False
 
         if mode in ("load", "all"):
             if cleaned_csv and os.path.exists(cleaned_csv):
-                load_pm25_to_sqlite(cleaned_csv)
+                load_pm25_to_sqlite(cleaned_csv, conn=conn)
                 logger.info("資料匯入完成")
             else:
                 logger.warning("找不到清理後檔案，匯入跳過")
@@ -49,11 +50,12 @@ def run_etl_pipeline(mode="all"):
         subj = f"[pm25] Pipeline Failed run_id={run_id}"
         body = f"mode={mode}\nstarted={started}\nended={ended}\nerror={repr(e)}\nrun_id={run_id}"
         send_email(subj, body)
-        return
+        return False
 
     ended = datetime.datetime.now()
     duration = (ended - started).total_seconds()
     logger.info(f"Pipeline 執行完成 耗時={duration:.1f}秒 run_id={run_id}")
+    return True
 
 if __name__ == "__main__":
     logger.info(f"開始時間：{datetime.datetime.now()}")
@@ -0,0 +1,254 @@
+import datetime
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import uuid
+from etl.run_pipeline import run_etl_pipeline
+from etl.fetch_pm25_daily import fetch_latest_monitordate, fetch_monitordate_count
+from etl.load_to_sqlite import (
+    connect_sqlite, get_latest_monitordate, get_first_loaded_at, count_monitordate, count_previous_monitordate,
+)
+from etl.export_extract import export_pm25_extract
+from etl.log_utils import set_run_id
+from etl.process_utils import pid_alive
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("PM25_DB_PATH", "db/pm25.sqlite")
+STATUS_PATH = os.getenv("PM25_SERVICE_STATUS", "logs/service_status.json")
+
+# 輪詢間隔（秒）：依預估的下一次發布時間排程，越接近越密集；錯誤或等待分批資料時退避
+POLL_MIN_SECONDS = int(os.getenv("PM25_POLL_MIN_SECONDS", "300"))
+POLL_MAX_SECONDS = int(os.getenv("PM25_POLL_MAX_SECONDS", "10800"))
+POLL_FACTOR = 2
+# 日資料約每 24 小時發布一次
+PUBLISH_PERIOD = datetime.timedelta(hours=24)
+
+
+def _now_str():
+    # 狀態檔時間一律記錄 UTC（欄位以 _utc 結尾），與匯出狀態檔一致
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _write_status(status, path=STATUS_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(status, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_status(path=STATUS_PATH):
+    """讀取常駐服務最近一次寫出的狀態，檔案不存在時回傳 None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def next_interval(interval, outcome, seconds_until_expected=None,
+                  min_seconds=POLL_MIN_SECONDS, max_seconds=POLL_MAX_SECONDS):
+    """依本次輪詢結果計算下一次等待秒數
+
+    outcome：
+    - complete：最新日期已到齊，等待下一日；以距預估發布時間的一半為間隔，逾時後維持下限
+    - progress：最新日期剛有新資料入庫但可能未到齊，以下限間隔追後續批次
+    - pending：最新日期未到齊但本輪沒有新資料，逐次加倍
+    - error：逐次加倍
+    """
+    if outcome == "complete":
+        if seconds_until_expected is None or seconds_until_expected <= 0:
+            return min_seconds
+        return max(min_seconds, min(max_seconds, int(seconds_until_expected // 2)))
+    if outcome == "progress":
+        return min_seconds
+    return max(min_seconds, min(max_seconds, interval * POLL_FACTOR))
+
+
+def _seconds_until_expected(conn, monitordate):
+    # 以該日最早入庫時間 + 24 小時估計下一日的發布時間（created_at 為 SQLite UTC）
+    first_loaded = get_first_loaded_at(conn, monitordate) if monitordate else None
+    if not first_loaded:
+        return None
+    loaded_at = datetime.datetime.strptime(str(first_loaded)[:19], "%Y-%m-%d %H:%M:%S")
+    now_utc = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (loaded_at + PUBLISH_PERIOD - now_utc).total_seconds()
+
+
+def _sleep(stop_event, seconds):
+    # 分段等待，讓 Windows 上的 Ctrl+C 也能即時中斷
+    remaining = seconds
+    while remaining > 0 and not stop_event.is_set():
+        step = min(remaining, 1)
+        stop_event.wait(step)
+        remaining -= step
+
+
+def _restore_handlers(previous_handlers):
+    for signum, handler in previous_handlers.items():
+        signal.signal(signum, handler)
+
+
+def run_service(db_path=DB_PATH, status_path=STATUS_PATH, stop_event=None):
+    """常駐模式：保持 HTTP Session 與 SQLite 連線，輪詢 API 有新 monitordate 時立即執行 pipeline"""
+    stop_event = stop_event or threading.Event()
+
+    # 同一狀態檔只允許一個服務執行，避免兩個常駐程序同時寫入資料庫
+    current = read_status(status_path)
+    if current and current.get("state") != "stopped" and pid_alive(current.get("pid")):
+        logger.error(f"常駐服務已在執行中 pid={current['pid']}，拒絕重複啟動")
+        raise RuntimeError(f"Service already running pid={current['pid']}")
+
+    def _handle_stop(signum, frame):
+        logger.info(f"收到停止訊號 signal={signum}，服務將於本輪結束後停止")
+        stop_event.set()
+
+    # signal 只能在主執行緒註冊；由其他執行緒驅動時改以 stop_event 停止
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        signums = [signal.SIGINT] + ([signal.SIGTERM] if hasattr(signal, "SIGTERM") else [])
+        for signum in signums:
+            previous_handlers[signum] = signal.signal(signum, _handle_stop)
+
+    service_run_id = f"service-{uuid.uuid4()}"
+    set_run_id(service_run_id)
+
+    try:
+        conn = connect_sqlite(db_path)
+    except Exception:
+        _restore_handlers(previous_handlers)
+        raise
+    interval = POLL_MIN_SECONDS
+    status = {
+        "state": "starting",
+        "pid": os.getpid(),
+        "run_id": service_run_id,
+        "started_at_utc": _now_str(),
+        "last_poll_at_utc": None,
+        "last_ingest_at_utc": None,
+        "last_ingest_run_id": None,
+        "last_ingest_ok": None,
+        "ingest_count": 0,
+        "last_export_at_utc": None,
+        "api_latest": None,
+        "api_latest_count": None,
+        "db_latest": get_latest_monitordate(conn),
+        "db_latest_count": None,
+        "complete_date": None,
+        "interval_seconds": interval,
+        "next_poll_at_utc": None,
+        "consecutive_errors": 0,
+        "last_error": None,
+    }
+    logger.info(f"常駐服務啟動 pid={status['pid']} db_latest={status['db_latest']}")
+    _write_status(status, status_path)
+
+    # 最近一次成功匯入時的 (monitordate, API 筆數)
+    attempted = (None, 0)
+    # 已確認到齊的最新日期；到齊後不再查詢該日筆數，只用 limit=1 探測新日期
+    complete_date = None
+
+    try:
+        while not stop_event.is_set():
+            status["state"] = "polling"
+            status["last_poll_at_utc"] = _now_str()
+            outcome = "pending"
+            try:
+                api_latest = fetch_latest_monitordate()
+                db_latest = get_latest_monitordate(conn)
+                status["api_latest"] = api_latest
+                status["db_latest"] = db_latest
+
+                if not api_latest or api_latest == complete_date or (db_latest and api_latest < db_latest):
+                    outcome = "complete"
+                    logger.info(f"尚無新資料 api_latest={api_latest} db_latest={db_latest}")
+                else:
+                    # 新日期或尚未到齊的日期：查詢該日 API 測站數，與資料庫比對（API 可能分批發布）
+                    api_count = fetch_monitordate_count(api_latest)
+                    db_count = count_monitordate(conn, api_latest)
+                    status["api_latest_count"] = api_count
+                    status["db_latest_count"] = db_count
+
+                    # 同一日期只在 API 筆數比上次匯入時增加才重跑，避免清洗時被剔除的列造成無限重試
+                    already_tried = attempted[0] == api_latest and attempted[1] >= api_count
+                    if api_count > db_count and not already_tried:
+                        logger.info(
+                            f"偵測到新資料 api_latest={api_latest}（API {api_count} 筆 / 資料庫 {db_count} 筆），開始匯入"
+                        )
+                        status["state"] = "ingesting"
+                        _write_status(status, status_path)
+
+                        ingest_run_id = str(uuid.uuid4())
+                        os.environ["RUN_ID"] = ingest_run_id
+                        set_run_id(ingest_run_id)
+                        try:
+                            ok = run_etl_pipeline("all", conn=conn, run_id=ingest_run_id)
+                        finally:
+                            os.environ["RUN_ID"] = service_run_id
+                            set_run_id(service_run_id)
+
+                        status["last_ingest_at_utc"] = _now_str()
+                        status["last_ingest_run_id"] = ingest_run_id
+                        status["last_ingest_ok"] = ok
+                        if not ok:
+                            raise RuntimeError(f"pipeline failed run_id={ingest_run_id}")
+
+                        attempted = (api_latest, api_count)
+                        status["ingest_count"] += 1
+                        status["db_latest"] = get_latest_monitordate(conn)
+                        db_count = count_monitordate(conn, api_latest)
+                        status["db_latest_count"] = db_count
+                        outcome = "progress"
+                        try:
+                            export_pm25_extract(conn=conn)
+                            status["last_export_at_utc"] = _now_str()
+                        except Exception:
+                            # 匯出失敗不影響入庫結果，下次匯入後會從同一 watermark 補齊
+                            logger.exception("增量匯出失敗")
+
+                    # 到齊條件：不少於前一日測站數，且追上 API（或 API 筆數自上次匯入後未再增加）
+                    expected = count_previous_monitordate(conn, api_latest)
+                    caught_up = db_count >= api_count or attempted == (api_latest, api_count)
+                    if caught_up and db_count >= expected:
+                        complete_date = api_latest
+                        outcome = "complete"
+                        logger.info(f"{api_latest} 資料已到齊（資料庫 {db_count} 筆）")
+                    else:
+                        logger.info(
+                            f"{api_latest} 可能尚未發布完整（API {api_count} 筆 / 資料庫 {db_count} 筆 / 前一日 {expected} 筆）"
+                        )
+            except Exception as e:
+                logger.exception("輪詢或匯入時發生錯誤")
+                outcome = "error"
+                status["last_error"] = repr(e)
+
+            status["consecutive_errors"] = status["consecutive_errors"] + 1 if outcome == "error" else 0
+            until = _seconds_until_expected(conn, complete_date or status["db_latest"]) if outcome == "complete" else None
+            interval = next_interval(interval, outcome, until)
+            next_poll = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=interval)
+            status["state"] = "sleeping"
+            status["complete_date"] = complete_date
+            status["interval_seconds"] = interval
+            status["next_poll_at_utc"] = next_poll.strftime("%Y-%m-%d %H:%M:%S")
+            _write_status(status, status_path)
+            logger.info(f"下次輪詢 {status['next_poll_at']}（間隔 {interval} 秒）")
+
+            _sleep(stop_event, interval)
+    finally:
+        _restore_handlers(previous_handlers)
+        conn.close()
+        status["state"] = "stopped"
+        status["next_poll_at_utc"] = None
+        _write_status(status, status_path)
+        logger.info("常駐服務已停止")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "status":
+        current = read_status()
+        print(json.dumps(current, ensure_ascii=False, indent=2) if current else "服務尚未啟動（找不到狀態檔）")
+    else:
+        run_service()
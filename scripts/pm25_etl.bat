@@ -16,6 +16,22 @@ if not exist ".env" (
     exit /b 1
 )
 
+REM Service mode: long-running process with adaptive polling (stop with Ctrl+C)
+REM "service status" prints the current status instead of starting the service
+REM Bare "exit /b" keeps python's exit code (%ERRORLEVEL% would be expanded before python runs)
+if "%1"=="service" (
+    echo [INFO] Mode: Long-running service, status file: logs\service_status.json
+    python -m etl.service %2
+    exit /b
+)
+
+REM Export mode: incremental extract for Tableau (add "full" to force a snapshot)
+if "%1"=="export" (
+    echo [INFO] Mode: Exporting Tableau extract to data\export
+    python -m etl.export_extract %2
+    exit /b
+)
+
 REM Check parameters
 if "%1"=="full" (
     echo [INFO] Mode: Loading full historical data